@@ -1,12 +1,15 @@
-from dataclasses import dataclass
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from functools import lru_cache
 from pathlib import Path
-from typing import List
+from typing import Dict, List, Set, Tuple
 
 import pytest
 import re
 import subprocess
 
-from ofrak import OFRAKContext
+from ofrak import OFRAK, OFRAKContext
 from ofrak.core.architecture import ProgramAttributes
 from ofrak_type.architecture import (
     InstructionSet,
@@ -29,6 +32,7 @@ from ofrak_patch_maker.toolchain.model import (
 )
 from ofrak_patch_maker.toolchain.utils import get_repository_config
 from ofrak_patch_maker.toolchain.version import ToolchainVersion
+from ofrak.service.id_service_sequential import SequentialIDService
 from ofrak_type.bit_width import BitWidth
 from ofrak_type.endianness import Endianness
 
@@ -37,16 +41,89 @@ X86_64_PROGRAM_PATH = str(Path(__file__).parent / "assets" / "hello.out")
 ARM32_PROGRAM_PATH = str(Path(__file__).parent / "assets" / "simple_arm_gcc.o.elf")
 
 
-def normalize_assembly(assembly_str: str) -> str:
+@lru_cache(maxsize=None)
+def get_bin_parser(toolchain_name: str) -> str:
     """
-    Normalize an assembly string:
+    Resolve the BIN_PARSER of `toolchain_name`, caching so toolchain.conf is parsed only once
+    per toolchain rather than once per test invocation.
+    """
+    bin_parser_path = get_repository_config("toolchain.conf", toolchain_name, "BIN_PARSER")
+
+    # LLVM-specific fix: use llvm-objdump, not llvm-readobj
+    if "readobj" in bin_parser_path:
+        bin_parser_path = bin_parser_path.replace("readobj", "objdump")
+
+    return bin_parser_path
+
+
+# Banner objdump prints before each input file, e.g. `replaced_hello.out:     file format elf64-x86-64`.
+_OBJDUMP_FILE_BANNER_RE = re.compile(rb"^(\S+):\s+file format .+$", re.MULTILINE)
+
+
+def run_objdump(
+    readobj_path: str, function_name: str, binary_paths: List[str]
+) -> Dict[str, bytes]:
+    """
+    Disassemble `function_name` in all of `binary_paths` with a single objdump invocation.
+
+    objdump accepts several input files and prints a `file format` banner before each one, so
+    batching all the binaries for one toolchain into one invocation pays the process-startup
+    cost once. The combined output is split on those banners and returned keyed by file path.
+    The output is left as bytes: the assertions compare normalized bytes, so there is no need
+    to decode objdump's stdout at all.
+
+    Only the target function is disassembled (`--disassemble=<sym>` for GNU objdump,
+    `--disassemble-symbols=<sym>` for llvm-objdump), so the output to normalize and search is
+    a handful of lines rather than every section in the binary.
+    """
+    if "llvm" in readobj_path:
+        disassemble_flag = f"--disassemble-symbols={function_name}"
+    else:
+        disassemble_flag = f"--disassemble={function_name}"
+    subprocess_result = subprocess.run(
+        [readobj_path, disassemble_flag, *binary_paths],
+        capture_output=True,
+    )
+    stdout = subprocess_result.stdout
+    banners = list(_OBJDUMP_FILE_BANNER_RE.finditer(stdout))
+    output_by_path: Dict[str, bytes] = {}
+    for i, banner in enumerate(banners):
+        end = banners[i + 1].start() if i + 1 < len(banners) else len(stdout)
+        output_by_path[banner.group(1).decode()] = stdout[banner.start() : end]
+    return output_by_path
+
+
+def run_objdump_on_bytes(readobj_path: str, function_name: str, binary_data: bytes) -> bytes:
+    """
+    Disassemble `function_name` in an in-memory binary fed to llvm-objdump over stdin.
+
+    This skips the flush-to-disk/read-back round trip entirely. Only llvm-objdump can read
+    its input from a pipe; GNU objdump's BFD backend requires a seekable file, so GNU
+    toolchains go through `run_objdump` on an on-disk binary instead.
+    """
+    subprocess_result = subprocess.run(
+        [readobj_path, f"--disassemble-symbols={function_name}", "-"],
+        input=binary_data,
+        capture_output=True,
+    )
+    return subprocess_result.stdout
+
+
+# Runs of intra-line whitespace, collapsed to a single space by `normalize_assembly`.
+_WS_RE = re.compile(rb"[ \t]+")
+
+
+def normalize_assembly(assembly: bytes) -> bytes:
+    """
+    Normalize an assembly dump:
     - strip leading and trailing whitespace from all lines
     - replace all consecutive strings of whitespace (including tabs) with a single space
+
+    Operates on bytes so objdump output can be normalized without decoding it, and collapses
+    whitespace with a single pass of a precompiled regex rather than one `re.sub` per line.
     """
-    assembly_lines = assembly_str.splitlines()
-    assembly_lines = [line.strip() for line in assembly_lines]
-    assembly_lines = [re.sub(r"\s+", " ", line) for line in assembly_lines]
-    return "\n".join(assembly_lines)
+    collapsed = _WS_RE.sub(b" ", assembly)
+    return b"\n".join(line.strip() for line in collapsed.split(b"\n"))
 
 
 @dataclass
@@ -58,6 +135,12 @@ class ProgramConfig:
     function_name: str
     function_vaddr: int
     function_size: int
+    # File name for the program after modification, precomputed so the test body does not
+    # rebuild a Path per invocation.
+    new_name: str = field(init=False)
+
+    def __post_init__(self):
+        self.new_name = f"replaced_{Path(self.path).name}"
 
 
 @dataclass
@@ -74,6 +157,14 @@ class FunctionReplacementTestCaseConfig:
     # Note that the comparison is done after applying `normalize_assembly()` on both texts.
     expected_objdump_output: List[str]
     compiler_optimization_level: CompilerOptimizationLevel = CompilerOptimizationLevel.SPACE
+    # `expected_objdump_output`, already normalized: the expected lines are constants, so they
+    # are normalized once at module load rather than in every test invocation.
+    expected_normalized: bytes = field(init=False)
+
+    def __post_init__(self):
+        self.expected_normalized = normalize_assembly(
+            "\n".join(self.expected_objdump_output).encode()
+        )
 
 
 X86_64_PROGRAM_CONFIG = ProgramConfig(
@@ -162,42 +253,113 @@ TEST_CASE_CONFIGS = [
 ]
 
 
-@pytest.mark.parametrize("config", TEST_CASE_CONFIGS)
-async def test_function_replacement_modifier(ofrak_context: OFRAKContext, config):
-    root_resource = await ofrak_context.create_root_resource_from_file(config.program.path)
-    await root_resource.unpack_recursively()
-    target_program = await root_resource.view_as(Program)
-
-    source_bundle_r = await target_program.resource.create_child(data=b"", tags=(SourceBundle,))
-    source_bundle = await source_bundle_r.view_as(SourceBundle)
-    await source_bundle.initialize_from_disk(PATCH_DIRECTORY)
-
-    function_cb = ComplexBlock(
-        virtual_address=config.program.function_vaddr,
-        size=config.program.function_size,
-        name=config.program.function_name,
-    )
+# Multi-pattern matcher over every case's normalized expected output, compiled once at module
+# load. A single scan of a normalized dump reports which expected blocks it contains, instead
+# of one substring search per pattern.
+_EXPECTED_OUTPUT_RE = re.compile(
+    b"|".join(re.escape(config.expected_normalized) for config in TEST_CASE_CONFIGS)
+)
 
-    function_cb_parent_code_region = await target_program.get_code_region_for_vaddr(
-        config.program.function_vaddr
-    )
 
-    function_cb.resource = await function_cb_parent_code_region.create_child_region(function_cb)
+def match_expected_outputs(normalized_output: bytes) -> Set[bytes]:
+    """Return the expected output blocks present in `normalized_output`, found in one scan."""
+    return {match.group(0) for match in _EXPECTED_OUTPUT_RE.finditer(normalized_output)}
 
-    # Create a dummy basic block in the complex block, so its `get_mode` method won't fail.
-    dummy_bb = BasicBlock(0, 0, InstructionSetMode.NONE, False, None)
-    await function_cb.resource.create_child_from_view(dummy_bb)
 
-    await target_program.define_linkable_symbols(
-        {config.program.function_name: (config.program.function_vaddr, LinkableSymbolType.FUNC)}
-    )
+@pytest.fixture(scope="session")
+def event_loop():
+    """Redefine `event_loop` with session scope, so session-scoped async fixtures can use it."""
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
 
-    target_program.resource.add_attributes(config.program.attrs)
 
-    await target_program.resource.save()
+@pytest.fixture(scope="session")
+async def unpacked_program_cache():
+    """
+    Get unpacked target programs, unpacking each program only once per session.
+
+    Several test cases target the same program with different toolchains; the unpacking work
+    (and the per-program setup built on top of it, including the ingested patch source
+    bundle) is identical for all of them, so it is done once per unique `ProgramConfig.path`
+    and the resulting `(Program, source bundle ID)` pair is shared. Each program gets its own
+    OFRAKContext, which is shut down at the end of the session.
+    """
+    cache: Dict[str, Tuple[OFRAKContext, Program, bytes]] = {}
+
+    async def get_unpacked_program(program_config: ProgramConfig) -> Tuple[Program, bytes]:
+        if program_config.path not in cache:
+            ofrak = OFRAK(logging.INFO)
+            ofrak.set_id_service(SequentialIDService())
+            ofrak_context = await ofrak.create_ofrak_context()
+
+            root_resource = await ofrak_context.create_root_resource_from_file(
+                program_config.path
+            )
+            # Unpack only the top level of the ELF: that is enough for the unpacker to carve
+            # out CodeRegions, and the test only needs the one containing the target function.
+            await root_resource.unpack()
+            target_program = await root_resource.view_as(Program)
+
+            function_cb = ComplexBlock(
+                virtual_address=program_config.function_vaddr,
+                size=program_config.function_size,
+                name=program_config.function_name,
+            )
+
+            function_cb_parent_code_region = await target_program.get_code_region_for_vaddr(
+                program_config.function_vaddr
+            )
+            await function_cb_parent_code_region.resource.unpack()
+
+            function_cb.resource = await function_cb_parent_code_region.create_child_region(
+                function_cb
+            )
+
+            # Create a dummy basic block in the complex block, so its `get_mode` method won't fail.
+            dummy_bb = BasicBlock(0, 0, InstructionSetMode.NONE, False, None)
+            await function_cb.resource.create_child_from_view(dummy_bb)
+
+            await target_program.define_linkable_symbols(
+                {
+                    program_config.function_name: (
+                        program_config.function_vaddr,
+                        LinkableSymbolType.FUNC,
+                    )
+                }
+            )
+
+            target_program.resource.add_attributes(program_config.attrs)
+
+            await target_program.resource.save()
+
+            source_bundle_r = await target_program.resource.create_child(
+                data=b"", tags=(SourceBundle,)
+            )
+            source_bundle = await source_bundle_r.view_as(SourceBundle)
+            await source_bundle.initialize_from_disk(PATCH_DIRECTORY)
+
+            cache[program_config.path] = (
+                ofrak_context,
+                target_program,
+                source_bundle.resource.get_id(),
+            )
+
+        _, target_program, source_bundle_id = cache[program_config.path]
+        return target_program, source_bundle_id
+
+    yield get_unpacked_program
+
+    for ofrak_context, _, _ in cache.values():
+        await ofrak_context.shutdown_context()
+
+
+@pytest.mark.parametrize("config", TEST_CASE_CONFIGS)
+async def test_function_replacement_modifier(unpacked_program_cache, config, tmp_path):
+    target_program, source_bundle_id = await unpacked_program_cache(config.program)
 
     function_replacement_config = FunctionReplacementModifierConfig(
-        source_bundle.resource.get_id(),
+        source_bundle_id,
         {config.program.function_name: config.replacement_patch},
         ToolchainConfig(
             file_format=BinFileType.ELF,
@@ -213,21 +375,25 @@ async def test_function_replacement_modifier(ofrak_context: OFRAKContext, config
     )
 
     await target_program.resource.run(FunctionReplacementModifier, function_replacement_config)
-    new_program_path = f"replaced_{Path(config.program.path).name}"
-    await target_program.resource.flush_to_disk(new_program_path)
 
     # Check that the modified program looks as expected.
-    readobj_path = get_repository_config("toolchain.conf", config.toolchain_name, "BIN_PARSER")
-
-    # LLVM-specific fix: use llvm-objdump, not llvm-readobj
-    if "readobj" in readobj_path:
-        readobj_path = readobj_path.replace("readobj", "objdump")
-
-    subprocess_result = subprocess.run(
-        [readobj_path, "-d", new_program_path], capture_output=True, text=True
-    )
-    readobj_output = subprocess_result.stdout
-
-    expected_objdump_output_str = "\n".join(config.expected_objdump_output)
-
-    assert normalize_assembly(expected_objdump_output_str) in normalize_assembly(readobj_output)
+    readobj_path = get_bin_parser(config.toolchain_name)
+
+    if "llvm" in readobj_path:
+        # llvm-objdump can disassemble straight from a pipe, skipping the disk round trip.
+        readobj_output = run_objdump_on_bytes(
+            readobj_path,
+            config.program.function_name,
+            await target_program.resource.get_data(),
+        )
+    else:
+        # GNU objdump needs a seekable file. Write it under tmp_path, which is typically
+        # tmpfs-backed on Linux CI and keeps parallel workers running two cases against the
+        # same source binary from clobbering each other's replaced_* output.
+        new_program_path = str(tmp_path / config.program.new_name)
+        await target_program.resource.flush_to_disk(new_program_path)
+        readobj_output = run_objdump(
+            readobj_path, config.program.function_name, [new_program_path]
+        )[new_program_path]
+
+    assert config.expected_normalized in match_expected_outputs(normalize_assembly(readobj_output))